@@ -6,9 +6,36 @@ Cache
 :version: 1.0
 """
 
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
 from pathlib import Path
+from queue import Queue
+from threading import Lock, Thread
+from typing import BinaryIO
+import hashlib
+import logging
+import os
 
-CACHE_DIR, DEFAULT_FILENAME = 'cache', 'idx'
+CACHE_DIR, FILE_EXT, CLEAR_WORKERS, RESOLVER_SZ = 'cache', '.bin', 8, 4096
+KEY_SZ, URI_SEP, PARTIAL_EXT = 8, b'\n', '.part'
+MEMORY_SZ, MEMORY_ITEM_SZ, DISK_SZ = 128 * 1024 * 1024, 64 * 1024, 1024 * 1024 * 1024
+
+log = logging.getLogger('proxy.cache')
+
+@lru_cache(maxsize=RESOLVER_SZ)
+def resolve_file_path(directory: str, uri: str) -> tuple:
+    """
+    Resolves where the response for a URI is cached.
+    Files are named after a hash of the URI and sharded across two levels of at most 256 directories.
+    :param directory: The directory of the cache
+    :param uri: The URI of the HTTP request
+    :return: The directory containing the cached file and the path of the file
+    """
+
+    key = hashlib.blake2b(uri.encode('UTF-8'), digest_size=KEY_SZ).hexdigest()
+    parent = os.path.join(directory, key[:2], key[2:4])
+    return parent, os.path.join(parent, key + FILE_EXT)
 
 class Cache(object):
     """A class that manages cached HTTP queries."""
@@ -25,55 +52,211 @@ class Cache(object):
             self.__clear_cache(path)
         else:
             path.mkdir()
+        self.index = OrderedDict()
+        self.disk_size = 0
+        self.lock = Lock()
+        self.unflushed = {}
+        self.memory = OrderedDict()
+        self.memory_size = 0
+        self.directories = set()
+        self.pending = Queue()
+        self.flusher = None
+        self.shared = False
     
     @staticmethod
     def __clear_cache(path: Path) -> None:
         """
-        Recursively clears all files from the cache.
+        Clears all files from the cache, emptying directories in parallel.
         :param path: A path object to clear files from
         """
 
-        for child in path.iterdir():
-            if child.is_file():
-                child.unlink()
-            else:
-                Cache.__clear_cache(child)
-                child.rmdir()
+        directories = []
+        with ThreadPoolExecutor(max_workers=CLEAR_WORKERS) as executor:
+            pending = [executor.submit(Cache.__clear_directory, str(path))]
+            while pending:
+                subdirectories = pending.pop().result()
+                directories.extend(subdirectories)
+                pending.extend(executor.submit(Cache.__clear_directory, d) for d in subdirectories)
+        for directory in reversed(directories):
+            os.rmdir(directory)
+
+    @staticmethod
+    def __clear_directory(directory: str) -> list:
+        """
+        Unlinks the files within a single directory.
+        :param directory: The directory to unlink files from
+        :return: The subdirectories that still need to be cleared
+        """
+
+        subdirectories = []
+        with os.scandir(directory) as entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    subdirectories.append(entry.path)
+                else:
+                    os.unlink(entry.path)
+        return subdirectories
     
-    def write(self, uri: str, response: str) -> None:
+    def write(self, uri: str, response: bytes) -> None:
         """
         Adds a web page response of a request to a cache.
+        The response is held in memory until it has been written to disk in the background.
+        The background writer is started by the first write, so no thread exists before the proxy forks.
         :param uri: The URI of the HTTP requested
         :param response: The response of the request
         """
 
-        path = Path(self.__create_file_path(uri))
-        path.write_text(response)
+        self.unflushed[uri] = response
+        self.pending.put((uri, response))
+        if self.flusher is None:
+            self.flusher = Thread(target=self.__flush, daemon=True)
+            self.flusher.start()
+
+    def recall(self, uri: str) -> bytes:
+        """
+        Retrieves a cached response that is held in memory, either awaiting its flush or recently read.
+        :param uri: The URI of the HTTP request
+        :return: The response, or None if it is not held in memory
+        """
+
+        response = self.unflushed.get(uri)
+        if response is None:
+            response = self.memory.get(uri)
+            if response is not None:
+                self.memory.move_to_end(uri)
+        return response
 
-    def read(self, uri: str) -> str:
-        """Retrieves a cached response corresponding to a requested URI."""
+    def remember(self, uri: str, response: bytes) -> None:
+        """
+        Holds a small response read from disk in memory, evicting the least recently used ones beyond capacity.
+        :param uri: The URI of the HTTP request
+        :param response: The response of the request
+        """
 
-        return Path(self.__get_file_path(uri)).read_text()
+        if len(response) > MEMORY_ITEM_SZ:
+            return
+        previous = self.memory.pop(uri, None)
+        if previous is not None:
+            self.memory_size -= len(previous)
+        self.memory[uri] = response
+        self.memory_size += len(response)
+        while self.memory_size > MEMORY_SZ:
+            self.memory_size -= len(self.memory.popitem(last=False)[1])
+
+    def open(self, uri: str) -> BinaryIO:
+        """
+        Opens the file a cached response has been written to, marking it as the most recently used.
+        The URI stored ahead of the response is verified in case another URI with the same hash replaced it.
+        When the directory is shared with other processes, files they wrote are adopted into the index.
+        :param uri: The URI of the HTTP request
+        :return: The file opened for binary reading and positioned at the response,
+            or None if the response is not on disk
+        """
+
+        with self.lock:
+            entry = self.index.get(uri)
+            if entry is not None:
+                self.index.move_to_end(uri)
+            elif not self.shared:
+                return None
+        path = entry[0] if entry is not None else resolve_file_path(self.dir, uri)[1]
+        try:
+            file = open(path, 'rb')
+        except OSError:
+            self.__forget(uri)
+            return None
+        if file.readline()[:-len(URI_SEP)] != uri.encode('UTF-8'):
+            file.close()
+            self.__forget(uri)
+            return None
+        if entry is None:
+            size = os.fstat(file.fileno()).st_size - file.tell()
+            with self.lock:
+                if uri not in self.index:
+                    self.index[uri] = (path, size)
+                    self.disk_size += size
+        return file
+
+    def load(self, uri: str) -> tuple:
+        """
+        Opens the file a cached response has been written to, reading the response right away
+        if it is small enough to be held in memory.
+        :param uri: The URI of the HTTP request
+        :return: The response and None if it was read, None and the file positioned at the response
+            if it is too large to read whole, or None and None if the response is not on disk
+        """
+
+        file = self.open(uri)
+        if file is None:
+            return None, None
+        if os.fstat(file.fileno()).st_size - file.tell() > MEMORY_ITEM_SZ:
+            return None, file
+        with file:
+            return file.read(), None
 
     def is_cached(self, uri: str) -> bool:
         """
         Checks is a web page response is cached.
+        A shared directory may hold responses written by other processes, so they are only known once opened.
         :param uri: The URI of the HTTP request
-        :return: True if the response is cached, False otherwise
+        :return: True if the response is cached or may be cached by another process, False otherwise
         """
 
-        return Path(self.__get_file_path(uri)).exists()
+        return uri in self.unflushed or uri in self.index or self.shared
 
-    def __create_file_path(self, uri: str) -> str:
-        """Creates a file path from the URI of a new response to cache."""
+    def __forget(self, uri: str) -> None:
+        """Removes a URI from the index of responses on disk."""
+
+        with self.lock:
+            entry = self.index.pop(uri, None)
+            if entry is not None:
+                self.disk_size -= entry[1]
+
+    def __flush(self) -> None:
+        """
+        Writes pending responses to the cache directory as they are queued.
+        Each file is written aside and renamed into place, so a file being sent is never truncated by a rewrite.
+        The file written aside is named after the process, since forked workers share the cache directory.
+        The least recently used files are removed once the cache grows beyond its capacity on disk.
+        """
 
-        segments = uri.split('/')
-        directory = '/'.join([self.dir, *segments[:-1]])
-        path = Path(directory)
-        path.mkdir(parents=True, exist_ok=True)
-        return '/'.join([directory, segments[-1] if segments[-1] else DEFAULT_FILENAME])
+        while True:
+            uri, response = self.pending.get()
+            try:
+                path = self.__create_file_path(uri)
+                partial = f'{path}.{os.getpid()}{PARTIAL_EXT}'
+                with open(partial, 'wb') as file:
+                    file.write(uri.encode('UTF-8') + URI_SEP)
+                    file.write(response)
+                os.replace(partial, path)
+                self.__forget(uri)
+                with self.lock:
+                    self.index[uri] = (path, len(response))
+                    self.disk_size += len(response)
+                    evicted = []
+                    while self.disk_size > DISK_SZ and len(self.index) > 1:
+                        evicted_path, size = self.index.popitem(last=False)[1]
+                        self.disk_size -= size
+                        evicted.append(evicted_path)
+                for evicted_path in evicted:
+                    if evicted_path != path:
+                        try:
+                            os.unlink(evicted_path)
+                        except FileNotFoundError:
+                            pass
+            except OSError as e:
+                log.warning('Could not write %s to the cache: %s', uri, e)
+            except Exception:
+                log.exception('Unexpected error writing %s to the cache', uri)
+            finally:
+                if self.unflushed.get(uri) is response:
+                    del self.unflushed[uri]
 
-    def __get_file_path(self, uri: str) -> str:
-        """Converts a URI to a corresponding file path."""
+    def __create_file_path(self, uri: str) -> str:
+        """Creates a file path from the URI of a new response to cache."""
 
-        return '/'.join([self.dir, f'{uri}{DEFAULT_FILENAME}' if uri[-1] == '/' else uri])
\ No newline at end of file
+        directory, path = resolve_file_path(self.dir, uri)
+        if directory not in self.directories:
+            os.makedirs(directory, exist_ok=True)
+            self.directories.add(directory)
+        return path
\ No newline at end of file
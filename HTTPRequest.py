@@ -7,10 +7,19 @@ HTTPRequest
 """
 
 from RequestError import RequestError
-from urllib.parse import urlparse
+from types import SimpleNamespace
 
-HTTP_PORT, HTTP_VERSION, HTTP_METHODS = 80, 1.1, {'GET'}
-DEFAULT_PATH, END_L = '/', '\r\n'
+try:
+    import httptools
+except ImportError:
+    httptools = None
+
+HTTP_PORT, HTTP_VERSION, HTTP_METHODS = 80, 1.1, frozenset({'GET'})
+METHOD_TOKENS = {b'GET': 'GET', b'get': 'GET'}
+DEFAULT_PATH, END_L, END_L_BYTES, HEADER_ENCODING = b'/', '\r\n', b'\r\n', 'ISO-8859-1'
+HTTP_VERSIONS = {b'HTTP/1.1': 1.1, b'HTTP/1.0': 1.0, b'HTTP/0.9': 0.9}
+HTTP_SCHEME, SCHEME_SEP, AUTHORITY_ENDS, FRAGMENT_SEP = b'http://', b'://', (b'/', b'?', b'#'), b'#'
+REQUEST_TEMPLATE = f'%s %s HTTP/{HTTP_VERSION}{END_L}Host: %s{END_L}Connection: keep-alive{END_L*2}'.encode()
 
 class HTTPRequest(object):
     """A wrapper class for an HTTP request."""
@@ -22,6 +31,7 @@ class HTTPRequest(object):
         """
 
         self.__parse_request(request)
+        self.__wire = request
 
     def __parse_request(self, request: bytes) -> None:
         """
@@ -30,71 +40,160 @@ class HTTPRequest(object):
         :raises RequestError: Invalid request
         """
 
-        method, uri, version, headers = self.__decode_request(request)
+        if httptools is not None:
+            method, uri, version, self.headers = self.__feed_parser(request)
+        else:
+            method, uri, version, headers = self.__decode_request(request)
+            self.headers = self.__parse_headers(headers)
         self.method = self.__parse_method(method)
         self.version = self.__parse_version(version)
-        self.headers = self.__parse_headers(headers)
         self.host, self.port, self.path, self.uri = self.__parse_uri(uri, self.headers)
 
     @staticmethod
     def __decode_request(request: bytes) -> tuple:
-        """Decodes the bytestring request."""
+        """Splits the request line of the bytestring request, leaving the method, URI, version, and headers as bytes."""
 
-        try:
-            parsed = request.decode('UTF-8').split(END_L)
-        except UnicodeDecodeError as e:
-            raise RequestError('Can not decode request')
-        request_line = parsed[0].split()
+        line_end = request.find(END_L_BYTES)
+        if line_end == -1:
+            line_end = len(request)
+        request_line = request[:line_end].split()
         if len(request_line) != 3:
             raise RequestError('Malformed request')
         method, uri, version = request_line
-        headers = parsed[1:]
+        headers = request[line_end + len(END_L_BYTES):]
         return method, uri, version, headers
 
     @staticmethod
-    def __parse_method(method: str) -> str:
-        """Parses an HTTP method."""
+    def __feed_parser(request: bytes) -> tuple:
+        """
+        Parses the request line and headers with the C-based httptools parser when it is installed.
+        Headers are keyed by their lowercase names, and the method, URI, and version are left as bytes.
+        A request is only accepted once the parser has seen the end of its headers.
+        """
+
+        uri, headers, complete = [], {}, []
+        parser = httptools.HttpRequestParser(SimpleNamespace(
+            on_url=uri.append,
+            on_header=lambda key, value: headers.__setitem__(key.lower(), value.strip()),
+            on_headers_complete=lambda: complete.append(True)
+        ))
+        try:
+            parser.feed_data(request)
+        except httptools.HttpParserUpgrade:
+            raise RequestError('Unsupported CONNECT or upgrade request')
+        except httptools.HttpParserError:
+            raise RequestError('Malformed request')
+        if not complete:
+            raise RequestError('Malformed request')
+        version = f'HTTP/{parser.get_http_version()}'.encode('ascii')
+        return parser.get_method(), b''.join(uri), version, headers
+
+    @staticmethod
+    def __decode(token: bytes) -> str:
+        """Decodes a token of the request, skipping UTF-8 validation when it is pure ASCII."""
 
+        if token.isascii():
+            return token.decode('ascii')
+        try:
+            return token.decode('UTF-8')
+        except UnicodeDecodeError as e:
+            raise RequestError('Can not decode request')
+
+    @staticmethod
+    def __parse_method(method: bytes) -> str:
+        """Parses an HTTP method, looking up common spellings before decoding the token."""
+
+        parsed_method = METHOD_TOKENS.get(method)
+        if parsed_method is not None:
+            return parsed_method
+        method = HTTPRequest.__decode(method)
         parsed_method = method.upper()
         if parsed_method not in HTTP_METHODS:
             raise RequestError(f'Unsupported or unrecognized HTTP method: {method}') 
         return parsed_method 
 
     @staticmethod
-    def __parse_version(version: str) -> float:
+    def __parse_version(version: bytes) -> float:
         """Parses an HTTP version."""
 
-        if not 'HTTP/' == version[:5] or not version[5:].replace('.', '', 1).isdigit():
-            raise RequestError(f'Unrecognized HTTP version: {version}')
-        version = float(version[5:])
-        if version > HTTP_VERSION:
-            raise RequestError(f'Unsupported HTTP version: {version}')
-        return version
+        try:
+            return HTTP_VERSIONS[version]
+        except KeyError:
+            raise RequestError(f'Unsupported or unrecognized HTTP version: {version.decode(HEADER_ENCODING)}')
 
     @staticmethod
-    def __parse_headers(headers: list) -> dict:
-        """Parses headers within a request."""
+    def __parse_headers(headers: bytes) -> dict:
+        """Parses headers within a request, keyed by their lowercase names."""
 
         parsed_headers = {}
-        for header in headers:
-            if header:
-                key, value = header.split(':', 1)
-                parsed_headers[key] = value.strip()
+        start, end = 0, len(headers)
+        while start < end:
+            eol = headers.find(END_L_BYTES, start)
+            if eol == -1:
+                eol = end
+            if eol == start:
+                break
+            colon = headers.find(b':', start, eol)
+            if colon == -1:
+                raise RequestError('Malformed request: Invalid header')
+            parsed_headers[headers[start:colon].lower()] = headers[colon + 1:eol].strip()
+            start = eol + len(END_L_BYTES)
         return parsed_headers
 
     @staticmethod
-    def __parse_uri(uri: str, headers: dict) -> tuple:
-        """Parses the URI of a request."""
+    def __parse_uri(uri: bytes, headers: dict) -> tuple:
+        """
+        Parses the URI of a request in either absolute form or origin form, converting internationalized hosts to IDNA.
+        The fragment is dropped, since it is neither sent to the server nor part of the cached URI.
+        """
 
-        parsed_uri = urlparse(uri)
-        if not parsed_uri.hostname and 'Host' not in headers:
+        scheme_end = uri.find(SCHEME_SEP)
+        if uri[:len(HTTP_SCHEME)].lower() == HTTP_SCHEME:
+            rest = uri[len(HTTP_SCHEME):]
+            end = len(rest)
+            for delimiter in AUTHORITY_ENDS:
+                index = rest.find(delimiter, 0, end)
+                if index != -1:
+                    end = index
+            authority, path = rest[:end], rest[end:]
+        elif scheme_end != -1 and b'/' not in uri[:scheme_end]:
+            raise RequestError('Unsupported URI scheme')
+        elif b'host' in headers:
+            authority, path = headers[b'host'], uri
+        else:
             raise RequestError('Malformed request: Invalid URI')
-        host = parsed_uri.hostname if parsed_uri.hostname else headers['Host']
-        port = parsed_uri.port if parsed_uri.port else HTTP_PORT
-        path = parsed_uri.path if parsed_uri.path else DEFAULT_PATH
+        host, port = HTTPRequest.__split_authority(authority)
+        host = HTTPRequest.__decode(host).lower()
+        if not host.isascii():
+            try:
+                host = host.encode('idna').decode('ascii')
+            except UnicodeError:
+                raise RequestError('Malformed request: Invalid host')
+        path = path.partition(FRAGMENT_SEP)[0]
+        if path[:1] != DEFAULT_PATH:
+            path = DEFAULT_PATH + path
+        path = HTTPRequest.__decode(path)
         uri = f'{host}{path}'
         return host, port, path, uri
 
+    @staticmethod
+    def __split_authority(authority: bytes) -> tuple:
+        """Splits the authority of a URI into its host and port."""
+
+        host = authority.rpartition(b'@')[2]
+        colon = host.rfind(b':')
+        if colon > host.rfind(b']'):
+            host, port = host[:colon], host[colon + 1:]
+            if port and (not port.isdigit() or int(port) > 65535):
+                raise RequestError('Malformed request: Invalid port')
+            port = int(port) if port else HTTP_PORT
+        else:
+            port = HTTP_PORT
+        host = host.strip(b'[]')
+        if not host:
+            raise RequestError('Malformed request: Invalid URI')
+        return host, port
+
     def modify_header(self, key: str, value: str) -> None:
         """
         Adds or updates a header to the request.
@@ -102,22 +201,30 @@ class HTTPRequest(object):
         :param value: The header's value
         """
 
-        self.headers[key] = value
+        self.headers[key.lower().encode(HEADER_ENCODING)] = value.encode(HEADER_ENCODING)
+        self.__wire = None
 
     @classmethod
-    def create_request(cls, method: str, host: str, path: str) -> 'HTTPRequest':
+    def create_request(cls, method: str, host: str, path: str, port: int = HTTP_PORT) -> 'HTTPRequest':
         """
         Generates a request in HTTP message format.
+        The request is assembled directly from a template rather than parsed from its wire form.
         :param method: The HTTP method of the request
         :param host: The host of the server to send the request to
         :param path: The path of the resource being requested
+        :param port: The port of the server to send the request to
         :return: An HTTP request
         """
 
-        request = f'{method.upper()} {path} HTTP/{HTTP_VERSION}{END_L}' \
-                  f'Host: {host}{END_L}' \
-                  f'Connection: close{END_L*2}'
-        return cls(request.encode('UTF-8'))
+        request = cls.__new__(cls)
+        request.method = method.upper()
+        request.version = HTTP_VERSION
+        request.host, request.port, request.path = host, port, path
+        request.uri = f'{host}{path}'
+        host_header = (host if port == HTTP_PORT else f'{host}:{port}').encode(HEADER_ENCODING)
+        request.headers = {b'host': host_header, b'connection': b'keep-alive'}
+        request.__wire = REQUEST_TEMPLATE % (request.method.encode('UTF-8'), path.encode('UTF-8'), host_header)
+        return request
 
     def get_method(self) -> str:
         """Retrieves the method of the request."""
@@ -147,11 +254,14 @@ class HTTPRequest(object):
     def __repr__(self) -> str:
         """Retrieves the string representation of an HTTPRequest object."""
 
-        request_line = f'{self.method} {self.path} HTTP/{self.version}'
-        headers = ''.join([f'{key}: {value}{END_L}' for key, value in self.headers.items()])
-        return f'{request_line}{END_L}{headers}{END_L}'
+        return bytes(self).decode('UTF-8', 'replace')
 
     def __bytes__(self) -> bytes:
         """Retrieves the bytestring representation of an HTTPRequest object."""
 
-        return self.__repr__().encode('UTF-8')
\ No newline at end of file
+        if self.__wire is None:
+            parts = [f'{self.method} {self.path} HTTP/{self.version}'.encode('UTF-8')]
+            parts.extend([key + b': ' + value for key, value in self.headers.items()])
+            parts.extend([b'', b''])
+            self.__wire = END_L_BYTES.join(parts)
+        return self.__wire
\ No newline at end of file
@@ -6,7 +6,11 @@ HTTPResponse
 :version: 1.0
 """
 
-HTTP_VERSION, END_L = 1.1, '\r\n'
+from RequestError import RequestError
+
+HTTP_VERSION, END_L, END_L_BYTES, HEADER_ENCODING = 1.1, '\r\n', b'\r\n', 'ISO-8859-1'
+DEFAULT_NAMES = {b'content-length': b'Content-Length', b'connection': b'Connection'}
+HEAD_TEMPLATE = f'HTTP/%s %d %s{END_L}Content-Length: %d{END_L}Connection: close{END_L*2}'.encode()
 
 class HTTPResponse(object):
     """A wrapper class for an HTTP response."""
@@ -18,24 +22,59 @@ class HTTPResponse(object):
         """
 
         self.__parse_response(response)
+        self.__wire = response
+        self.__head_wire = None
 
     def __parse_response(self, response: bytes) -> None:
         """
         Parses the contents of an HTTP response.
         :param response: The original HTTP response
+        :raises RequestError: Malformed status line
         """
 
-        parsed = response.decode('UTF-8').split(END_L*2)
-        headers = parsed[0].split(END_L)
-        status_line = headers[0].split()
-        self.version = status_line[0].split('HTTP/')[1]
-        self.status_code = int(status_line[1])
-        self.status_message = ' '.join(status_line[2:])
-        self.headers = {}
-        for header in headers[1:]:
-            key, value = header.split(':', 1)
-            self.modify_header(key, value.strip())
-        self.body = parsed[1] if len(parsed) > 1 else ''
+        head_end = response.find(END_L_BYTES*2)
+        if head_end == -1:
+            head_end = len(response)
+        line_end = response.find(END_L_BYTES, 0, head_end)
+        if line_end == -1:
+            line_end = head_end
+        version, _, status = response[:line_end].partition(b' ')
+        status_code, _, status_message = status.strip().partition(b' ')
+        if len(status_code) != 3 or not status_code.isdigit():
+            raise RequestError('Malformed response: Invalid status line')
+        self.version = version.partition(b'HTTP/')[2].decode(HEADER_ENCODING)
+        self.status_code = int(status_code)
+        self.status_message = status_message.strip().decode(HEADER_ENCODING)
+        self.headers, self.names = self.__parse_headers(response, line_end + len(END_L_BYTES), head_end)
+        self.content_length = None if self.is_chunked() else self.__parse_content_length(self.headers.get(b'content-length'))
+        self.body = response[head_end + len(END_L_BYTES)*2:]
+
+    @staticmethod
+    def __parse_headers(response: bytes, start: int, end: int) -> tuple:
+        """
+        Parses the headers between two offsets of a response in a single pass, keyed by their lowercase names.
+        The names as the server spelled them are kept alongside, so they are written back unchanged.
+        """
+
+        headers, names = {}, {}
+        while start < end:
+            eol = response.find(END_L_BYTES, start, end)
+            if eol == -1:
+                eol = end
+            colon = response.find(b':', start, eol)
+            if colon != -1:
+                name = response[start:colon]
+                key = name.lower()
+                headers[key] = response[colon + 1:eol].strip()
+                names[key] = name
+            start = eol + len(END_L_BYTES)
+        return headers, names
+
+    @staticmethod
+    def __parse_content_length(value: bytes) -> int:
+        """Parses the Content-Length of a response, or None if it is absent or invalid."""
+
+        return int(value) if value is not None and value.isdigit() else None
 
     def modify_header(self, key: str, value: str) -> None:
         """
@@ -44,34 +83,81 @@ class HTTPResponse(object):
         :param value: The header's value
         """
 
+        name, value = key.encode(HEADER_ENCODING), str(value).encode(HEADER_ENCODING)
+        key = name.lower()
         self.headers[key] = value
+        self.names.setdefault(key, name)
+        if key == b'content-length':
+            self.content_length = self.__parse_content_length(value)
+        self.__wire = None
+        self.__head_wire = None
 
     def has_full_body(self) -> bool:
-        """Determines if the full body of a response is contained."""
+        """
+        Determines if the full body of a response is contained.
+        A response without a Content-Length is only complete once the server closes the connection.
+        """
+
+        return self.content_length is not None and len(self.body) >= self.content_length
+
+    def is_chunked(self) -> bool:
+        """Determines if the body of the response is sent with chunked transfer coding."""
+
+        return b'chunked' in self.headers.get(b'transfer-encoding', b'').lower()
 
-        return len(self.body.encode('UTF-8')) == int(self.headers['Content-Length'])
+    def is_persistent(self) -> bool:
+        """Determines if the server keeps the connection open after a complete response."""
 
-    def extend_body(self, addend: str) -> None:
-        """Extends the body of the response."""
+        if self.content_length is None or len(self.body) != self.content_length:
+            return False
+        connection = self.headers.get(b'connection', b'').lower()
+        if self.version == '1.0':
+            return connection == b'keep-alive'
+        return connection != b'close'
 
-        self.body = f'{self.body}{addend}'
+    def set_body(self, body: bytes) -> None:
+        """Replaces the body of the response."""
+
+        self.body = body
+        self.__wire = None
 
     @classmethod
-    def create_response(cls, status_code: int, message: str, body: str = '') -> 'HTTPResponse':
+    def create_response(cls, status_code: int, message: str, body: bytes = b'', headers: dict = None) -> 'HTTPResponse':
         """
         Generates a response in HTTP message format.
+        The response is assembled directly rather than parsed from its wire form.
         :param status_code: The status code of the response
         :param message: The status message of the response
         :param body: The body of the response
+        :param headers: Additional headers of the response, overriding the defaults
         :return: An HTTP response
         """
 
-        content_length = len(body.encode('UTF-8'))
-        response = f'HTTP/{HTTP_VERSION} {status_code} {message}{END_L}' \
-                   f'Content-Length: {content_length}{END_L}' \
-                   f'Connection: close{END_L*2}' \
-                   f'{body}'
-        return cls(response.encode('UTF-8'))
+        response = cls.__new__(cls)
+        response.version = str(HTTP_VERSION)
+        response.status_code = status_code
+        response.status_message = message
+        response.headers = {b'content-length': b'%d' % len(body), b'connection': b'close'}
+        response.names = dict(DEFAULT_NAMES)
+        response.content_length = len(body)
+        response.body = body
+        response.__head_wire = None
+        if headers:
+            for name, value in headers.items():
+                name = name.encode(HEADER_ENCODING)
+                response.headers[name.lower()] = str(value).encode(HEADER_ENCODING)
+                response.names.setdefault(name.lower(), name)
+            response.content_length = cls.__parse_content_length(response.headers[b'content-length'])
+            head = response.__head()
+        else:
+            head = response.__head_wire = HEAD_TEMPLATE % (
+                response.version.encode(HEADER_ENCODING),
+                status_code,
+                message.encode(HEADER_ENCODING),
+                len(body)
+            )
+        response.__wire = None if body else head
+        return response
 
     def get_status_code(self) -> int:
         """Retrieves the status code of the response."""
@@ -84,21 +170,47 @@ class HTTPResponse(object):
         :param key: The name of the header to get the value for
         """
 
-        return self.headers[key]
+        return self.headers[key.lower().encode(HEADER_ENCODING)].decode(HEADER_ENCODING)
+
+    def get_content_length(self) -> int:
+        """Retrieves the Content-Length of the response, or None if it has none."""
+
+        return self.content_length
 
-    def get_body(self) -> str:
+    def get_body(self) -> bytes:
         """Retrieves the body of the response."""
 
         return self.body
 
+    def get_buffers(self) -> tuple:
+        """
+        Retrieves the wire form of the response as a sequence of buffers.
+        The head and body are kept apart unless already joined, so they can be written without concatenating them.
+        """
+
+        if self.__wire is not None:
+            return (self.__wire,)
+        return self.__head(), self.body
+
+    def __head(self) -> bytes:
+        """Retrieves the status line and headers of the response, memoizing them until a header is modified."""
+
+        if self.__head_wire is not None:
+            return self.__head_wire
+        parts = [f'HTTP/{self.version} {self.status_code} {self.status_message}'.encode(HEADER_ENCODING)]
+        parts.extend([self.names[key] + b': ' + value for key, value in self.headers.items()])
+        parts.extend([b'', b''])
+        self.__head_wire = END_L_BYTES.join(parts)
+        return self.__head_wire
+
     def __repr__(self) -> str:
         """Retrieves the string representation of an HTTPResponse object."""
 
-        status_line = f'HTTP/{self.version} {self.status_code} {self.status_message}'
-        headers = ''.join([f'{key}: {value}{END_L}' for key, value in self.headers.items()])
-        return END_L.join([status_line, headers, self.body])
+        return bytes(self).decode('UTF-8', 'replace')
 
     def __bytes__(self) -> bytes:
         """Retrieves the bytestring representation of an HTTPResponse object."""
 
-        return self.__repr__().encode('UTF-8')
\ No newline at end of file
+        if self.__wire is None:
+            self.__wire = self.__head() + self.body
+        return self.__wire
\ No newline at end of file
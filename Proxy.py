@@ -10,11 +10,33 @@ from Cache import Cache
 from HTTPRequest import HTTPRequest
 from HTTPResponse import HTTPResponse
 from RequestError import RequestError
-from socket import *
+from collections import OrderedDict, defaultdict, deque
+from concurrent.futures import ThreadPoolExecutor
+from socket import socket, AF_INET, IPPROTO_TCP, SOCK_STREAM, SOL_SOCKET, SO_REUSEADDR, TCP_NODELAY
+import asyncio
+import logging
+import os
+import signal
+import time
 
-HOSTNAME, BUF_SZ, BACKLOG, TIMEOUT = 'localhost', 4096, 5, 1
+try:
+    import uvloop
+except ImportError:
+    uvloop = None
+
+try:
+    from socket import TCP_QUICKACK
+except ImportError:
+    TCP_QUICKACK = None
+
+HOSTNAME, BUF_SZ, BACKLOG, TIMEOUT = 'localhost', 65536, 5, 1
+POOL_SZ, KEEP_ALIVE, WORKERS, DNS_TTL, DNS_SZ = 8, 5, 64, 60, 1024
+END_L, END_HEADERS, CLIENT_TIMEOUT = b'\r\n', b'\r\n\r\n', 30
 OK, NOT_FOUND, INTRNL_ERR = 200, 404, 500
-HTTP_CODES = {OK, NOT_FOUND, INTRNL_ERR}
+HTTP_CODES = frozenset({OK, NOT_FOUND, INTRNL_ERR})
+INTERNAL_ERROR = bytes(HTTPResponse.create_response(INTRNL_ERR, 'Internal Server Error', headers={'Cache-Hit': 0}))
+
+log = logging.getLogger('proxy')
 
 class Proxy(object):
     """A proxy that caches HTTP traffic between clients and servers."""
@@ -24,6 +46,8 @@ class Proxy(object):
 
         self.listener, self.address = self.__start_server(port)
         self.cache = Cache()
+        self.connections = defaultdict(deque)
+        self.addresses = OrderedDict()
 
     def __start_server(self, port: int) -> tuple:
         """
@@ -34,120 +58,387 @@ class Proxy(object):
 
         address = (HOSTNAME, port)
         server = socket(AF_INET, SOCK_STREAM)
+        server.setsockopt(SOL_SOCKET, SO_REUSEADDR, 1)
+        server.setsockopt(IPPROTO_TCP, TCP_NODELAY, 1)
         server.bind(address)
         server.listen(BACKLOG)
         return server, address
 
-    def run(self) -> None:
-        """Executes the proxy."""
+    def run(self, processes: int = 1) -> None:
+        """
+        Executes the proxy, on a uvloop event loop if uvloop is installed.
+        Additional processes are forked to accept from the same listening socket, each with its own event loop.
+        Terminating the first process shuts down the processes it forked.
+        :param processes: The number of processes serving clients
+        """
         
+        self.cache.shared = processes > 1
+        children = []
+        for _ in range(processes - 1):
+            pid = os.fork()
+            if pid == 0:
+                children = None
+                break
+            children.append(pid)
+        if children:
+            signal.signal(signal.SIGTERM, signal.default_int_handler)
         try:
-            while True:
-                self.__resolve()
+            with asyncio.Runner(loop_factory=uvloop.new_event_loop if uvloop else None) as runner:
+                runner.run(self.__serve(children is not None))
         except KeyboardInterrupt:
-            print('\nShutting down...')
+            if children is not None:
+                print('\nShutting down...')
+        finally:
             self.listener.close()
+            for pid in children or ():
+                os.kill(pid, signal.SIGTERM)
+                os.waitpid(pid, 0)
+
+    async def __serve(self, announce: bool) -> None:
+        """
+        Serves incoming client connections concurrently on the listening socket.
+        Blocking work such as name resolution and opening cached files runs on a bounded thread pool.
+        :param announce: Whether to announce that the proxy is ready
+        """
 
-    def __resolve(self) -> None:
-        """Resolves an incoming client connection and request."""
+        asyncio.get_running_loop().set_default_executor(ThreadPoolExecutor(max_workers=WORKERS))
+        server = await asyncio.start_server(self.__resolve, sock=self.listener, limit=BUF_SZ)
+        if announce:
+            print('\n\n******************** Ready to serve ********************')
+        async with server:
+            await server.serve_forever()
 
-        print('\n\n******************** Ready to serve ********************')
-        conn, addr = self.listener.accept()
-        print(f'Received client connection from {addr}')
+    async def __resolve(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        """
+        Resolves an incoming client connection and request.
+        A client disconnecting before its response is written is only logged.
+        :param reader: The stream to read the client request from
+        :param writer: The stream to write the response to
+        """
+
+        log.debug('Received client connection from %s', writer.get_extra_info('peername'))
         try:
-            request = conn.recv(BUF_SZ)
-            print(f'Received message from client: {request}')
+            await self.__respond(reader, writer)
+        except ConnectionError as e:
+            log.debug('Client disconnected: %s', e)
+        finally:
+            log.debug('All done! Closing socket...')
+            writer.close()
+
+    async def __respond(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        """
+        Reads a client request and writes the response to it.
+        :param reader: The stream to read the client request from
+        :param writer: The stream to write the response to
+        """
+
+        try:
+            request = await Proxy.__receive_request(reader)
+            if log.isEnabledFor(logging.DEBUG):
+                log.debug('Received message from client: %r', request)
             request = HTTPRequest(request)
+            if await self.__retrieve_from_cache(request.get_uri(), writer):
+                return
+            response = await self.__forward_to_server(request, writer)
+            if response is None:
+                return
         except RequestError as e:
-            print(e)
-            is_cached = False
-            response = HTTPResponse.create_response(INTRNL_ERR, 'Internal Server Error')
+            log.info('%s', e)
+            writer.write(INTERNAL_ERROR)
         else:
-            uri = request.get_uri()
-            is_cached = self.cache.is_cached(uri)
-            response = self.__retrieve_from_cache(uri) if is_cached else self.__forward_to_server(request)
-        response.modify_header('Cache-Hit', int(is_cached))
-        print('Now responding to the client...')
-        conn.sendall(bytes(response))
-        print('All done! Closing socket...')
-        conn.close()
-
-    def __retrieve_from_cache(self, uri: str) -> HTTPResponse:
-        """
-        Retrieves the web page body of a cached response.
+            response.modify_header('Cache-Hit', 0)
+            log.debug('Now responding to the client...')
+            writer.writelines(response.get_buffers())
+        await writer.drain()
+
+    @staticmethod
+    async def __receive_request(reader: asyncio.StreamReader) -> bytes:
+        """
+        Receives a request from a client, reading until the end of its headers.
+        :param reader: The stream to read the client request from
+        :return: The request line and headers of the request
+        :raises RequestError: The headers exceed the stream's limit or never arrive
+        """
+
+        try:
+            return await asyncio.wait_for(reader.readuntil(END_HEADERS), CLIENT_TIMEOUT)
+        except asyncio.IncompleteReadError as e:
+            return e.partial
+        except asyncio.LimitOverrunError:
+            raise RequestError('Request headers too large')
+        except asyncio.TimeoutError:
+            raise RequestError('Timed out waiting for request headers')
+
+    async def __retrieve_from_cache(self, uri: str, writer: asyncio.StreamWriter) -> bool:
+        """
+        Responds with the web page body of a cached response.
+        Small bodies are served from memory, while larger bodies on disk are sent with sendfile
+        so they never pass through user space. Where sendfile is unavailable, they are copied in chunks
+        read on the thread pool.
         :param uri: The URI of the original HTTP request
-        :return: An HTTP response created with the cached web page body
+        :param writer: The stream to write the response to
+        :return: True if the response was sent, False if it is not cached
         """
 
-        print('Yay! The requested file was found in the cache!')
-        body = self.cache.read(uri)
-        return HTTPResponse.create_response(OK, 'OK', body)
+        loop = asyncio.get_running_loop()
+        body = self.cache.recall(uri)
+        if body is None:
+            if not self.cache.is_cached(uri):
+                return False
+            body, file = await loop.run_in_executor(None, self.cache.load, uri)
+            if file is not None:
+                with file:
+                    offset = file.tell()
+                    size = os.fstat(file.fileno()).st_size - offset
+                    log.debug('Yay! The requested file was found in the cache!')
+                    response = HTTPResponse.create_response(OK, 'OK', headers={'Content-Length': size, 'Cache-Hit': 1})
+                    writer.write(bytes(response))
+                    try:
+                        await loop.sendfile(writer.transport, file, offset, size)
+                    except NotImplementedError:
+                        while chunk := await loop.run_in_executor(None, file.read, BUF_SZ):
+                            writer.write(chunk)
+                            await writer.drain()
+                return True
+            if body is None:
+                return False
+            self.cache.remember(uri, body)
+        log.debug('Yay! The requested file was found in the cache!')
+        response = HTTPResponse.create_response(OK, 'OK', body, {'Cache-Hit': 1})
+        writer.writelines(response.get_buffers())
+        await writer.drain()
+        return True
 
-    def __forward_to_server(self, request: HTTPRequest) -> HTTPResponse:
+    async def __forward_to_server(self, request: HTTPRequest, writer: asyncio.StreamWriter) -> HTTPResponse:
         """
         Forwards a client request to the requested server.
+        A body that does not arrive along with the response's head is relayed to the client as it is received.
         :param request: The original HTTP request
-        :return: The response to the request
+        :param writer: The stream to relay the response to
+        :return: The response to the request, or None if it was already relayed to the client
+        :raises RequestError: Failed request or unsupported response
         """
 
-        print('Oops! No cache hit! Requesting origin server for the file...')
+        log.debug('Oops! No cache hit! Requesting origin server for the file...')
         server_request = HTTPRequest.create_request(
             request.get_method(),
             request.get_host(),
-            request.get_path()
+            request.get_path(),
+            request.get_port()
         )
+        address = (request.get_host(), request.get_port())
+        if log.isEnabledFor(logging.DEBUG):
+            log.debug('Sending the following message to proxy to server:\n%s', server_request)
+        response, server = await self.__transmit_request(server_request, address)
+        log.debug('Response received from server with status code %d', response.get_status_code())
+        if response.get_status_code() not in HTTP_CODES:
+            server.close()
+            raise RequestError(f'Unsupported status code from server: {response.get_status_code()}')
+        response.modify_header('Connection', 'close')
+        relayed = not response.has_full_body()
+        if relayed:
+            response.modify_header('Cache-Hit', 0)
+            writer.writelines(response.get_buffers())
+            try:
+                await Proxy.__relay_body(server, response, writer)
+            except (OSError, ValueError) as e:
+                log.info('Relaying the response from %s:%d failed: %s', *address, e)
+                server.close()
+                return None
+        self.__settle_connection(address, server, response)
+        if response.get_status_code() == OK and (response.has_full_body() or response.get_content_length() is None):
+            log.debug('Writing to cache...')
+            self.cache.write(request.get_uri(), response.get_body())
+        return None if relayed else response
+
+    async def __transmit_request(self, request: HTTPRequest, address: tuple) -> tuple:
+        """
+        Sends a request to a server, reusing an idle connection to it if one is pooled.
+        :param request: The request to send
+        :param address: The hostname and port of the server
+        :return: The response to the request, holding as much of the body as arrived with its head,
+            and the socket gateway to the connection it is still being received from
+        :raises RequestError: Failed request, including a hostname that can not be encoded for resolution
+        """
+
         try:
-            print(f'Sending the following message to proxy to server:\n{server_request}')
-            response = self.__transmit_request(server_request)
-        except RequestError as e:
-            print(e)
-            response = HTTPResponse.create_response(INTRNL_ERR, 'Internal Server Error')
+            server = self.__acquire_connection(address)
+            if server is not None:
+                try:
+                    return await Proxy.__exchange(request, server), server
+                except (ConnectionError, RequestError):
+                    log.debug('Pooled connection to %s:%d went stale, reconnecting...', *address)
+            server = await self.__connect(address)
+            return await Proxy.__exchange(request, server), server
+        except (OSError, UnicodeError) as e:
+            raise RequestError(e)
+
+    async def __connect(self, address: tuple) -> socket:
+        """
+        Opens a new connection to a server, resolving its hostname again only once the previous lookup expires.
+        Lookups are kept in a bounded LRU that drops expired and least recently used hosts.
+        :param address: The hostname and port of the server
+        :return: The socket gateway to the connection with the server
+        """
+
+        loop = asyncio.get_running_loop()
+        host, port = address
+        entry = self.addresses.get(host)
+        if entry is not None and entry[1] < time.monotonic():
+            del self.addresses[host]
+            entry = None
+        if entry is None:
+            addresses = await loop.getaddrinfo(host, port, family=AF_INET, type=SOCK_STREAM)
+            now = time.monotonic()
+            entry = self.addresses[host] = (addresses[0][4][0], now + DNS_TTL)
+            while self.addresses and (len(self.addresses) > DNS_SZ or next(iter(self.addresses.values()))[1] < now):
+                self.addresses.popitem(last=False)
         else:
-            print('Response received from server')
-            print(f'Status code is {response.get_status_code()}')
-            if response.get_status_code() == OK:
-                print(f'Writing to cache...')
-                self.cache.write(request.get_uri(), response.get_body())
-            elif response.get_status_code() not in HTTP_CODES:
-                response = HTTPResponse.create_response(INTRNL_ERR, 'Internal Server Error',)
-        return response
+            self.addresses.move_to_end(host)
+        ip = entry[0]
+        server = socket(AF_INET, SOCK_STREAM)
+        server.setsockopt(IPPROTO_TCP, TCP_NODELAY, 1)
+        server.setblocking(False)
+        try:
+            await asyncio.wait_for(loop.sock_connect(server, (ip, port)), TIMEOUT)
+        except BaseException:
+            server.close()
+            raise
+        return server
 
     @staticmethod
-    def __transmit_request(request: HTTPRequest) -> HTTPResponse:
+    async def __exchange(request: HTTPRequest, server: socket) -> HTTPResponse:
         """
-        Sends a request to a server.
+        Sends a request over a connection and receives the head of the response to it.
+        Where supported, quick acknowledgements are rearmed so the server is not held up by a delayed ACK.
         :param request: The request to send
-        :return: The response to the request
-        :raises RequestError: Failed request
+        :param server: The socket gateway to the connection with the server
+        :return: The response to the request, holding as much of the body as arrived with its head
         """
 
+        loop = asyncio.get_running_loop()
         try:
-            with socket(AF_INET, SOCK_STREAM) as server:
-                address = (request.get_host(), request.get_port())
-                server.connect(address)
-                server.settimeout(TIMEOUT)
-                server.sendall(bytes(request))
-                return Proxy.__receive_response(server)
-        except (timeout, gaierror, ConnectionRefusedError) as e:
-            raise RequestError(e)
+            await loop.sock_sendall(server, bytes(request))
+            if TCP_QUICKACK is not None:
+                server.setsockopt(IPPROTO_TCP, TCP_QUICKACK, 1)
+            data = await asyncio.wait_for(loop.sock_recv(server, BUF_SZ), TIMEOUT)
+            if not data:
+                raise RequestError('Connection closed by server')
+            return HTTPResponse(data)
+        except BaseException:
+            server.close()
+            raise
+
+    def __settle_connection(self, address: tuple, server: socket, response: HTTPResponse) -> None:
+        """
+        Pools a connection again if the server keeps it open after a response, closing it otherwise.
+        :param address: The hostname and port of the server
+        :param server: The socket gateway to the connection with the server
+        :param response: The response last received over the connection
+        """
+
+        if response.is_persistent():
+            self.__release_connection(address, server)
+        else:
+            server.close()
+
+    def __acquire_connection(self, address: tuple) -> socket:
+        """
+        Takes the most recently used idle connection to a server from the pool.
+        :param address: The hostname and port of the server
+        :return: The socket gateway to the connection, or None if no live connection is pooled
+        """
+
+        connections, now = self.connections.get(address), time.monotonic()
+        while connections:
+            server, expiry = connections.pop()
+            if expiry > now:
+                log.debug('Reusing pooled connection to %s:%d', *address)
+                return server
+            server.close()
+        return None
+
+    def __release_connection(self, address: tuple, server: socket) -> None:
+        """
+        Returns an idle connection to a server to the pool, evicting the oldest one if the pool is full.
+        :param address: The hostname and port of the server
+        :param server: The socket gateway to the connection with the server
+        """
+
+        connections = self.connections[address]
+        if len(connections) >= POOL_SZ:
+            connections.popleft()[0].close()
+        connections.append((server, time.monotonic() + KEEP_ALIVE))
 
     @staticmethod
-    def __receive_response(sock: socket) -> HTTPResponse:
+    async def __relay_body(sock: socket, response: HTTPResponse, writer: asyncio.StreamWriter) -> None:
         """
-        Receives a response from a server.
+        Receives the rest of a response's body from a server, relaying each part to the client as it arrives.
+        The body is received directly into a buffer sized by the response's Content-Length,
+        or until the server closes the connection if the response has none.
         :param sock: The socket gateway to the connection with the server
-        :return: The response to the request
+        :param response: The response whose head and first part of the body were received
+        :param writer: The stream to relay the body to
         """
 
-        response = HTTPResponse(sock.recv(BUF_SZ))
-        if response.has_full_body():
-            return response
+        if response.is_chunked():
+            return await Proxy.__relay_chunked(sock, response, writer)
+        loop = asyncio.get_running_loop()
         body = response.get_body()
-        received = len(body.encode('UTF-8'))
-        content_length = int(response.get_header('Content-Length'))
+        content_length = response.get_content_length()
+        if content_length is None:
+            chunks = [body]
+            while data := await asyncio.wait_for(loop.sock_recv(sock, BUF_SZ), TIMEOUT):
+                chunks.append(data)
+                writer.write(data)
+                await writer.drain()
+            response.set_body(b''.join(chunks))
+            return
+        received = len(body)
+        buffer = bytearray(content_length)
+        view = memoryview(buffer)
+        view[:received] = body
         while received < content_length:
-            data = sock.recv(BUF_SZ)
-            if not data: break
-            received += len(data)
-            response.extend_body(data.decode('UTF-8'))
-        return response
\ No newline at end of file
+            n = await asyncio.wait_for(loop.sock_recv_into(sock, view[received:]), TIMEOUT)
+            if not n: break
+            writer.write(view[received:received + n])
+            received += n
+            await writer.drain()
+        response.set_body(buffer if received == content_length else buffer[:received])
+
+    @staticmethod
+    async def __relay_chunked(sock: socket, response: HTTPResponse, writer: asyncio.StreamWriter) -> None:
+        """
+        Receives the rest of a chunked response's body from a server, relaying each part to the client as it arrives.
+        The relayed bytes keep their chunked framing, while the body kept for the response is decoded.
+        :param sock: The socket gateway to the connection with the server
+        :param response: The response whose head and first part of the body were received
+        :param writer: The stream to relay the body to
+        :raises ConnectionError: The server closed the connection before the last chunk
+        :raises ValueError: Malformed chunk size
+        """
+
+        loop = asyncio.get_running_loop()
+        data, body, start = bytearray(response.get_body()), bytearray(), 0
+        while True:
+            eol = data.find(END_L, start)
+            if eol != -1:
+                size = int(data[start:eol].partition(b';')[0], 16)
+                if size < 0:
+                    raise ValueError(f'Invalid chunk size: {size}')
+                if not size and data.find(END_HEADERS, eol) != -1:
+                    break
+                if size and len(data) >= eol + len(END_L) + size + len(END_L):
+                    start = eol + len(END_L)
+                    body += data[start:start + size]
+                    start += size + len(END_L)
+                    continue
+            del data[:start]
+            start = 0
+            chunk = await asyncio.wait_for(loop.sock_recv(sock, BUF_SZ), TIMEOUT)
+            if not chunk:
+                raise ConnectionError('Connection closed before the last chunk')
+            data += chunk
+            writer.write(chunk)
+            await writer.drain()
+        response.set_body(body)
\ No newline at end of file
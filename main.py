@@ -19,31 +19,51 @@ supporting HTTP/1.05.
 """
 
 from Proxy import Proxy
+import logging
+import os
 import sys
 
 MIN_PORT, MAX_PORT = 10000, 65535
+LOG_LEVEL_VAR, DEFAULT_LOG_LEVEL = 'PROXY_LOG', 'WARNING'
+PROCESSES_VAR, DEFAULT_PROCESSES = 'PROXY_PROCESSES', '1'
 
-def has_valid_args() -> bool:
-    """Checks the validity of command line arguments."""
+def parse_args() -> int:
+    """
+    Parses and validates the command line arguments.
+    :return: The port to listen from, or None if the arguments are invalid
+    """
 
-    return len(sys.argv) == 2 and \
-        sys.argv[1].isdigit() and \
-        MIN_PORT <= int(sys.argv[1]) <= MAX_PORT
+    if len(sys.argv) != 2:
+        return None
+    try:
+        port = int(sys.argv[1])
+    except ValueError:
+        return None
+    return port if MIN_PORT <= port <= MAX_PORT else None
 
 def main() -> None:
     """Runs the web proxy program."""
         
-    if not has_valid_args():
+    port = parse_args()
+    if port is None:
         print('USAGE: python3 proxy.py <PORT>')
         print(f'PORT must be a valid, unreserved TCP port between {MIN_PORT} and {MAX_PORT}')
         exit(1)
-    port = int(sys.argv[1])
+    processes = os.environ.get(PROCESSES_VAR, DEFAULT_PROCESSES)
+    if not processes.isdigit() or int(processes) < 1:
+        print(f'{PROCESSES_VAR} must be a positive number of processes')
+        exit(1)
+    log_level = os.environ.get(LOG_LEVEL_VAR, DEFAULT_LOG_LEVEL).upper()
+    if log_level not in logging.getLevelNamesMapping():
+        print(f'{LOG_LEVEL_VAR} must be a logging level, such as DEBUG, INFO, WARNING, or ERROR')
+        exit(1)
+    logging.basicConfig(level=log_level)
     try:
         proxy = Proxy(port)
     except OSError as e:
         print(f'Could not execute the web proxy: {e}')
     else:
-        proxy.run()  
+        proxy.run(int(processes))  
 
 if __name__ == '__main__':
     main()
\ No newline at end of file